@@ -1,13 +1,27 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import jwt
 import time
+import random
 import datetime
 import re
-from collections import defaultdict
+import string
+from concurrent.futures import ThreadPoolExecutor
 import plotly.express as px
+import plotly.graph_objects as go
 import json 
+import io
+
+# orjson is much faster on big getMessages pages; stdlib json is the fallback
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # ==========================================
 # 1. PAGE CONFIGURATION
@@ -91,7 +105,16 @@ st.markdown("""
         color: white;
     }
 
-    /* 6. Table Styling */
+    /* 6. Chart Cards (st.container keys) */
+    .st-key-activity_card, .st-key-top_card {
+        background: white;
+        padding: 15px;
+        border-radius: 10px;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        margin: 1rem 0;
+    }
+
+    /* 7. Table Styling */
     div[data-testid="stDataFrame"] {
         background-color: white;
         padding: 10px;
@@ -106,185 +129,432 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Regex for filters
-UUID_PATTERN = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+# Hex digits for the UUID filter
+_HEX_DIGITS = string.hexdigits
+
+# Regex / entity table for clean_kore_text
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_ENTITIES = {'&nbsp;': ' ', '&amp;': '&', '&quot;': '"'}
+_ENTITY_RE = re.compile('|'.join(map(re.escape, _ENTITIES)))
+
+# Pages requested concurrently once the first page confirms there is more
+# (keep <= the adapter's pool_maxsize so every worker gets a pooled socket)
+PAGE_BATCH = 8
+
+# Paging politeness: no pause while the API answers faster than this (seconds),
+# how many times a throttled (429) page is retried after Retry-After,
+# and the longest Retry-After we will actually sleep for (seconds)
+HEALTHY_LATENCY = 0.2
+MAX_THROTTLE_RETRIES = 3
+MAX_RETRY_AFTER = 30
+
+# moreAvailable sometimes stays true past the last page; stop after this many empty pages in a row
+MAX_EMPTY_PAGES = 3
+
+# Date ranges whose last successful fetch is kept to fall back on when the API fails
+MAX_LAST_GOOD = 8
+
+# Past this many points the activity chart switches from SVG bars to WebGL
+MAX_SVG_MARKS = 500
+
+# Rows sent to the logs table; the CSV download has all of them
+MAX_DISPLAY_ROWS = 500
+
+# Layout shared by both charts, built once instead of on every rerun
+BASE_LAYOUT = dict(
+    paper_bgcolor="rgba(0,0,0,0)",
+    plot_bgcolor="rgba(0,0,0,0)",
+    margin=dict(l=20, r=20, t=30, b=20)
+)
 
 # ==========================================
 # 3. HELPER FUNCTIONS
 # ==========================================
+@st.cache_resource
+def http_session():
+    # One pooled session per server process: the HTTPS socket stays alive across pages and reruns
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=10,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.2,
+            # 429 is left to the page loop (capped Retry-After, fractional values allowed);
+            # urllib3 would retry it again underneath and rejects fractional headers
+            status_forcelist=[500, 502, 503, 504],
+            respect_retry_after_header=False,
+            allowed_methods=frozenset(["POST"]),  # getMessages is a read, safe to retry
+            raise_on_status=False  # let the error panel below show the final response
+        )
+    ))
+    session.headers.update({"content-type": "application/json"})
+    return session
+
+@st.cache_resource
+def jwt_cache():
+    # (client_id, hash(client_secret)) -> (token, exp); the secret itself is never stored
+    return {}
+
 def generate_jwt(client_id, client_secret):
+    cache = jwt_cache()
+    key = (client_id, hash(client_secret))
+    now = int(time.time())
+    
+    # Tokens live an hour; reuse one until it is a minute from expiring
+    cached = cache.get(key)
+    if cached and cached[1] - now > 60: return cached[0]
+    
     payload = {
         "appId": client_id,
         "sub": "bot-auth",
-        "iat": int(time.time()),
-        "exp": int(time.time()) + 3600
+        "iat": now,
+        "exp": now + 3600
     }
-    return jwt.encode(payload, client_secret, algorithm="HS256")
+    token = jwt.encode(payload, client_secret, algorithm="HS256")
+    cache[key] = (token, payload["exp"])
+    return token
+
+def retry_after_seconds(response, attempt):
+    # Honour a numeric Retry-After; without one (or in HTTP-date form) back off
+    # exponentially with jitter so repeated 429s wait 2, 4, 8... seconds
+    try:
+        seconds = float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        seconds = 2 ** attempt + random.random()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+def _looks_like_uuid(s):
+    # Same shape as 8-4-4-4-12 hex, without the regex engine
+    if len(s) != 36: return False
+    if s[8] != '-' or s[13] != '-' or s[18] != '-' or s[23] != '-': return False
+    return not (s[0:8] + s[9:13] + s[14:18] + s[19:23] + s[24:36]).strip(_HEX_DIGITS)
 
 def clean_kore_text(raw_text):
     if not raw_text: return ""
-    # Handle JSON
-    if raw_text.strip().startswith("{"):
+    # Handle JSON (first-char check avoids a stripped copy of every message;
+    # only parse when one of the keys we use is actually there)
+    first = raw_text[0]
+    is_json = first == "{" or (first.isspace() and raw_text.lstrip().startswith("{"))
+    if is_json and ('"text"' in raw_text or '"payload"' in raw_text):
         try:
-            parsed = json.loads(raw_text)
+            parsed = json_loads(raw_text)
             if isinstance(parsed, dict) and "text" in parsed:
                 raw_text = parsed["text"]
             elif "payload" in parsed:
                 return f"[Interactive: {parsed.get('type', 'template')}]"
-        except: pass
+        except ValueError: pass
+    
+    # Plain text (most chat bubbles): nothing to strip
+    if '<' not in raw_text and '&' not in raw_text: return raw_text
     
     # Strip HTML & Fix Entities
-    clean_text = re.sub(r'<[^>]+>', '', raw_text)
-    clean_text = clean_text.replace('&nbsp;', ' ').replace('&amp;', '&').replace('&quot;', '"')
+    clean_text = _HTML_TAG_RE.sub('', raw_text) if '<' in raw_text else raw_text
+    if '&' in clean_text:
+        # Only the entities Kore.ai emits, and only with their semicolon:
+        # a URL query like &copy=3 or &para=x stays as sent
+        clean_text = _ENTITY_RE.sub(lambda m: _ENTITIES[m.group(0)], clean_text)
     return clean_text
 
 # ==========================================
 # 4. DATA FETCHING (UPDATED ERROR HANDLING)
 # ==========================================
-@st.cache_data(ttl=300, show_spinner=False)
-def fetch_data(bot_id, client_id, client_secret, date_from, date_to):
-    token = generate_jwt(client_id, client_secret)
+@st.cache_resource
+def cache_stats():
+    # Survives reruns (module globals don't); shown in the sidebar when DEBUG is set
+    return {"fetch": {"hits": 0, "misses": 0}, "pairs": {"hits": 0, "misses": 0}}
+
+@st.cache_resource
+def last_good_fetch():
+    # (bot_id, date_from, date_to) -> (fetched_at, messages) of the last error-free fetch
+    return {}
+
+def count_cache_call(name, cached_fn, *args, **kwargs):
+    # Cached bodies bump "misses" themselves, so no change means it was a hit
+    stats = cache_stats()[name]
+    misses = stats["misses"]
+    result = cached_fn(*args, **kwargs)
+    if stats["misses"] == misses: stats["hits"] += 1
+    return result
+
+FETCH_SPINNER = "⏳ Fetching messages from Kore.ai..."
+
+def show_fetch_error(error):
+    if error["kind"] == "connection":
+        st.error(f"🔌 Connection Error: {error['detail']}")
+        return
+    
+    st.error(f"🛑 CRITICAL API ERROR on Page {error['page']}")
+    st.markdown(f"**Status Code:** `{error['status']} {error['reason']}`")
+    
+    with st.expander("🔍 View Full Error Response (Click to Expand)", expanded=True):
+        try:
+            # Try to pretty print JSON error
+            st.json(json_loads(error["body"]))
+        except ValueError:
+            # Otherwise print raw text
+            st.code(error["body"])
+
+# No st.* calls in here: whatever a cached function draws is replayed on every hit.
+# Errors come back as data and fetch_data renders them.
+# Credentials are underscore args so Streamlit leaves them out of the cache key
+@st.cache_data(ttl=300, show_spinner=FETCH_SPINNER)
+def _fetch_data_cached(bot_id, date_from, date_to, *, _client_id, _client_secret, _page_gap=0.0):
+    cache_stats()["fetch"]["misses"] += 1
+    token = generate_jwt(_client_id, _client_secret)
     host = "https://de-platform.kore.ai" 
     url = f"{host}/api/public/bot/{bot_id}/getMessages"
     
-    headers = { "auth": token, "content-type": "application/json" }
+    headers = { "auth": token } # content-type is set on the session
+    
+    # Column lists (one per field) instead of a dict per message
+    all_messages = {"Timestamp": [], "SessionID": [], "UserID": [], "Sender": [], "Message": []}
+    timestamps = all_messages["Timestamp"]
+    session_ids = all_messages["SessionID"]
+    user_ids = all_messages["UserID"]
+    senders = all_messages["Sender"]
+    texts = all_messages["Message"]
+    
+    # Locals for the per-message loop (cheaper than global lookups)
+    clean = clean_kore_text
+    is_uuid = _looks_like_uuid
     
-    all_messages = []
     skip = 0
     has_more = True
     limit = 100
     
-    # Custom Progress UI
-    progress_placeholder = st.empty()
-    bar = st.progress(0)
+    base_payload = {
+        "limit": limit,
+        "dateFrom": date_from.strftime('%Y-%m-%d'),
+        "dateTo": date_to.strftime('%Y-%m-%d'),
+        "forward": "false" 
+    }
+    
+    session = http_session()
+    
+    def fetch_page(page_skip):
+        payload = {**base_payload, "skip": page_skip}
+        return session.post(url, headers=headers, json=payload, timeout=(5, 30))
     
     page_count = 0
+    latency = None # EWMA of page response time
+    empty_pages = 0
+    error = None
     
-    while has_more:
-        try:
-            payload = {
-                "skip": skip,
-                "limit": limit,
-                "dateFrom": date_from.strftime('%Y-%m-%d'),
-                "dateTo": date_to.strftime('%Y-%m-%d'),
-                "forward": "false" 
-            }
-            response = requests.post(url, headers=headers, json=payload)
-            
-            # --- IMPROVED ERROR HANDLING ---
-            if response.status_code != 200:
-                st.error(f"🛑 CRITICAL API ERROR on Page {page_count + 1}")
-                st.markdown(f"**Status Code:** `{response.status_code} {response.reason}`")
-                
-                with st.expander("🔍 View Full Error Response (Click to Expand)", expanded=True):
-                    try:
-                        # Try to pretty print JSON error
-                        st.json(response.json())
-                    except:
-                        # Otherwise print raw text
-                        st.code(response.text)
-                
-                # Stop the spinner
-                progress_placeholder.empty()
-                bar.empty()
-                break # Exit loop, return partial data
-            # -------------------------------
+    with ThreadPoolExecutor(max_workers=PAGE_BATCH) as pool:
+        while has_more:
+            try:
+                # First page alone to learn moreAvailable, then speculative batches.
+                # Pages past the end just come back empty and are discarded below.
+                batch = 1 if page_count == 0 else PAGE_BATCH
+                responses = pool.map(fetch_page, [skip + i * limit for i in range(batch)])
                 
-            data = response.json()
-            messages = data.get("messages", [])
-            
-            page_count += 1
-            progress_placeholder.info(f"⏳ Reading page {page_count}... ({len(all_messages)} chats so far)")
-            bar.progress(min(page_count * 5, 90))
-            
-            for msg in messages:
-                raw_text = ""
-                if msg.get("components") and len(msg["components"]) > 0:
-                    raw_text = msg["components"][0].get("data", {}).get("text", "")
+                for response in responses:
+                    # Throttled: wait as told (or back off) and ask for the same page again
+                    throttled = 0
+                    while response.status_code == 429 and throttled < MAX_THROTTLE_RETRIES:
+                        throttled += 1
+                        time.sleep(retry_after_seconds(response, throttled))
+                        response = fetch_page(skip)
+                    
+                    # --- IMPROVED ERROR HANDLING ---
+                    if response.status_code != 200:
+                        error = {
+                            "kind": "api", "page": page_count + 1,
+                            "status": response.status_code, "reason": response.reason,
+                            "body": response.text,
+                        }
+                        has_more = False
+                        break # Exit loop, return partial data
+                    # -------------------------------
+                        
+                    data = json_loads(response.content)
+                    messages = data.get("messages", [])
+                    
+                    elapsed = response.elapsed.total_seconds()
+                    latency = elapsed if latency is None else 0.7 * latency + 0.3 * elapsed
+                    
+                    page_count += 1
+                    empty_pages = 0 if messages else empty_pages + 1
+                    
+                    for msg in messages:
+                        raw_text = ""
+                        comps = msg.get("components")
+                        if comps:
+                            comp_data = comps[0].get("data")
+                            if comp_data: raw_text = comp_data.get("text", "")
+                        # Event/system entries carry no text; don't pay for a clean() call
+                        if not raw_text: continue
+                        
+                        final_text = clean(raw_text)
+                        clean_msg_strip = final_text.strip()
+
+                        if not final_text: continue
+                        if is_uuid(clean_msg_strip): continue
+                        if "@@userdetailspayload@@" in clean_msg_strip: continue
+
+                        timestamps.append(msg.get("createdOn"))
+                        session_ids.append(msg.get("sessionId", "unknown"))
+                        user_ids.append(msg.get("createdBy", "system"))
+                        senders.append("USER" if msg.get("type") == "incoming" else "BOT")
+                        texts.append(final_text)
+                    
+                    has_more = data.get("moreAvailable", False) and empty_pages < MAX_EMPTY_PAGES
+                    skip += limit
+                    if not has_more:
+                        break
                 
-                final_text = clean_kore_text(raw_text)
-                clean_msg_strip = final_text.strip()
-
-                if not final_text: continue
-                if UUID_PATTERN.match(clean_msg_strip): continue
-                if "@@userdetailspayload@@" in clean_msg_strip: continue
-
-                all_messages.append({
-                    "Timestamp": msg.get("createdOn"),
-                    "SessionID": msg.get("sessionId", "unknown"),
-                    "UserID": msg.get("createdBy", "system"),
-                    "Sender": "USER" if msg.get("type") == "incoming" else "BOT",
-                    "Message": final_text
-                })
-            
-            has_more = data.get("moreAvailable", False)
-            if has_more:
-                skip += limit
-                time.sleep(0.1)
-            else:
-                bar.progress(100)
+                # Only back off once the API starts slowing down
+                if has_more and latency >= HEALTHY_LATENCY:
+                    time.sleep(max(0, _page_gap - latency))
+                    
+            except Exception as e:
+                error = {"kind": "connection", "detail": str(e)}
                 break
-                
-        except Exception as e:
-            st.error(f"🔌 Connection Error: {e}")
-            break
             
-    progress_placeholder.empty()
-    bar.empty()
+    return all_messages, error
+
+def fetch_data(bot_id, date_from, date_to, *, _client_id, _client_secret, _page_gap=0.0):
+    all_messages, error = count_cache_call(
+        "fetch", _fetch_data_cached, bot_id, date_from, date_to,
+        _client_id=_client_id, _client_secret=_client_secret, _page_gap=_page_gap
+    )
+    last_good = last_good_fetch()
+    key = (bot_id, date_from, date_to)
+    if error:
+        show_fetch_error(error)
+        # Serve the last complete result instead of an empty or partial one
+        stale = last_good.get(key)
+        if stale and len(stale[1]["Message"]) > len(all_messages["Message"]):
+            fetched_at, all_messages = stale
+            st.warning(f"⚠️ Showing data from the last successful fetch ({time.strftime('%H:%M', time.localtime(fetched_at))}).")
+    else:
+        last_good.pop(key, None) # re-insert so the oldest range is evicted first
+        last_good[key] = (time.time(), all_messages)
+        if len(last_good) > MAX_LAST_GOOD:
+            del last_good[next(iter(last_good))]
     return all_messages
 
 # ==========================================
 # 5. PROCESSING
 # ==========================================
 def process_to_pairs(raw_data):
-    sessions = defaultdict(list)
-    for msg in raw_data:
-        sessions[msg['SessionID']].append(msg)
+    # raw_data is fetch_data's dict of column lists
+    if not raw_data["Message"]:
+        return pd.DataFrame()
+    
+    msgs = pd.DataFrame(raw_data)
+    # Few sessions/senders, many messages: work on int codes instead of hashing strings
+    msgs = msgs.astype({'SessionID': 'category', 'Sender': 'category'})
+    # Parsed before the sort so it compares int64 ns, not strings
+    msgs['Timestamp'] = pd.to_datetime(msgs['Timestamp'], format='ISO8601', utc=True, cache=True, errors='coerce')
+    msgs = msgs.sort_values(['SessionID', 'Timestamp'], kind='stable')
+    
+    # Every USER message opens a new pair in its session.
+    # Pair 0 is whatever the bot said first (Welcome) and is dropped.
+    msgs['PairID'] = (msgs['Sender'] == "USER").groupby(msgs['SessionID'], observed=True).cumsum()
+    msgs = msgs[msgs['PairID'] > 0]
+    is_user = msgs['Sender'] == "USER"
     
-    final_pairs = []
+    keys = ['SessionID', 'PairID']
+    # Bot rows are already contiguous per (session, pair) after the sort, so join
+    # plain list slices between boundaries; groupby().agg(str.join) would go
+    # through pandas' per-group Python path
+    bot = msgs[~is_user]
+    codes = bot['SessionID'].cat.codes.to_numpy()
+    pair_ids = bot['PairID'].to_numpy()
+    starts = np.flatnonzero((codes[1:] != codes[:-1]) | (pair_ids[1:] != pair_ids[:-1])) + 1
+    starts = np.r_[0, starts] if len(bot) else starts
+    ends = np.r_[starts[1:], len(bot)]
+    texts = bot['Message'].tolist()
+    responses = pd.Series(
+        [" \n ".join(texts[a:b]) for a, b in zip(starts.tolist(), ends.tolist())],
+        index=pd.MultiIndex.from_arrays([bot['SessionID'].iloc[starts], pair_ids[starts]], names=keys),
+        name='Response', dtype=object
+    )
+    
+    df = msgs[is_user].join(responses, on=keys)
+    if df.empty:
+        return pd.DataFrame()
+    
+    df['Response'] = df['Response'].fillna("")
+    df = df.rename(columns={'Message': 'Query'})[['Timestamp', 'SessionID', 'UserID', 'Query', 'Response']]
+    # Response is free text: Arrow string (less memory, cheaper hash at the cache boundary).
+    # The rest repeat a lot, so they stay categorical and nunique/value_counts run on int codes;
+    # sessions that only had welcome messages are gone, so drop their unused categories.
+    df['Response'] = df['Response'].astype('string[pyarrow]')
+    df['SessionID'] = df['SessionID'].cat.remove_unused_categories()
+    df = df.astype({'UserID': 'category', 'Query': 'category'})
+    df = df.sort_values(by='Timestamp', ascending=False)
+    # Day bucket for the activity chart: datetime64[D] keeps the groupby on int64, not date objects
+    df['Date'] = df['Timestamp'].values.astype('datetime64[D]')
+    return df
+
+# Same key as the fetch, so reruns with unchanged inputs skip pair-building too.
+# Streamlit only shows the outermost spinner, so the fetch's message goes here;
+# fetch errors drawn inside are replayed with the cached pairs.
+@st.cache_data(ttl=300, show_spinner=FETCH_SPINNER)
+def _get_pairs_cached(bot_id, date_from, date_to, *, _client_id, _client_secret, _page_gap=0.0):
+    cache_stats()["pairs"]["misses"] += 1
+    raw_data = fetch_data(
+        bot_id, date_from, date_to,
+        _client_id=_client_id, _client_secret=_client_secret, _page_gap=_page_gap
+    )
+    # Message count lets the UI tell "nothing fetched" from "all filtered out"
+    return len(raw_data["Message"]), process_to_pairs(raw_data)
+
+def get_pairs(bot_id, date_from, date_to, *, _client_id, _client_secret, _page_gap=0.0):
+    return count_cache_call(
+        "pairs", _get_pairs_cached, bot_id, date_from, date_to,
+        _client_id=_client_id, _client_secret=_client_secret, _page_gap=_page_gap
+    )
+
+# Built once per result, not on every rerun; the frame itself is not hashed (_df),
+# the fetch inputs plus the row count identify it
+@st.cache_data(ttl=300, show_spinner=False)
+def make_csv(bot_id, date_from, date_to, row_count, _df):
+    buf = io.BytesIO()
+    buf.write(b'\xef\xbb\xbf') # UTF-8 BOM so Excel opens it correctly
+    _df.to_csv(buf, index=False, encoding='utf-8', lineterminator='\n')
+    return buf.getvalue()
 
-    for session_id, chats in sessions.items():
-        chats.sort(key=lambda x: x['Timestamp'])
-        current_pair = None
-        
-        for chat in chats:
-            text = chat['Message']
-            sender = chat['Sender']
-            
-            if sender == "USER":
-                if current_pair: final_pairs.append(current_pair)
-                current_pair = {
-                    "Timestamp": chat['Timestamp'],
-                    "SessionID": session_id,
-                    "UserID": chat['UserID'],
-                    "Query": text,
-                    "Response": "" 
-                }
-            elif sender == "BOT":
-                if current_pair:
-                    if current_pair["Response"]: current_pair["Response"] += " \n " + text
-                    else: current_pair["Response"] = text
-                else:
-                    final_pairs.append({
-                        "Timestamp": chat['Timestamp'],
-                        "SessionID": session_id,
-                        "UserID": chat['UserID'],
-                        "Query": "(Bot Initiated / Welcome)",
-                        "Response": text
-                    })
-        
-        if current_pair: final_pairs.append(current_pair)
+# Same keying as make_csv; zstd Parquet skips per-field quoting and keeps the dtypes
+@st.cache_data(ttl=300, show_spinner=False)
+def make_parquet(bot_id, date_from, date_to, row_count, _df):
+    buf = io.BytesIO()
+    _df.to_parquet(buf, engine='pyarrow', compression='zstd', index=False)
+    return buf.getvalue()
 
-    if final_pairs:
-        df = pd.DataFrame(final_pairs)
-        df = df[df['Query'] != "(Bot Initiated / Welcome)"]
+# Figure builders: px.bar costs ~25ms per call, while the summary tables they
+# are keyed on are a few rows and hash cheaply
+@st.cache_data(ttl=300, show_spinner=False)
+def activity_figure(daily_counts):
+    if len(daily_counts) > MAX_SVG_MARKS:
+        fig = go.Figure(go.Scattergl(
+            x=daily_counts['Date'], y=daily_counts['Count'],
+            mode='lines', line=dict(color='#005A9C')
+        ))
+    else:
+        fig = px.bar(
+            daily_counts, x='Date', y='Count',
+            color_discrete_sequence=['#005A9C'] 
+        )
+    fig.update_layout(**BASE_LAYOUT, xaxis_title="", yaxis_title="Queries")
+    return fig
 
-        if not df.empty:
-            df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-            df = df.sort_values(by='Timestamp', ascending=False)
-            return df
-            
-    return pd.DataFrame()
+@st.cache_data(ttl=300, show_spinner=False)
+def top_figure(top_questions):
+    fig = px.bar(
+        top_questions, x='Count', y='Question', 
+        orientation='h', text='Count',
+        color_discrete_sequence=['#EC008C'] 
+    )
+    fig.update_layout(
+        **BASE_LAYOUT,
+        yaxis=dict(autorange="reversed"),
+        xaxis_title="Frequency", yaxis_title=""
+    )
+    return fig
 
 # ==========================================
 # 6. MAIN UI
@@ -337,6 +607,10 @@ def main():
     except:
         st.sidebar.error("❌ Secrets missing in .streamlit/secrets.toml")
         st.stop()
+    
+    # Optional per-bot target gap between page batches (seconds); only applied once the
+    # averaged page latency passes HEALTHY_LATENCY, and shortened by that latency
+    page_gap = float(st.secrets.get("PAGE_GAP", 0))
 
     today = datetime.date.today()
     start_date = st.sidebar.date_input("Start Date", today - datetime.timedelta(days=7))
@@ -349,93 +623,79 @@ def main():
 
     # --- MAIN CONTENT ---
     if fetch_btn:
-        raw_data = fetch_data(bot_id, client_id, client_secret, start_date, end_date)
+        message_count, df = get_pairs(
+            bot_id, start_date, end_date,
+            _client_id=client_id, _client_secret=client_secret, _page_gap=page_gap
+        )
         
-        if raw_data:
-            df = process_to_pairs(raw_data)
-            
+        if message_count:
             if not df.empty:
                 # 1. METRICS CARDS
                 st.markdown("### 📈 Key Performance Indicators")
                 m1, m2, m3, m4 = st.columns(4)
                 
+                # process_to_pairs leaves no unused categories, so these are O(1) nunique
                 m1.metric("Total Queries", len(df))
-                m2.metric("Unique Users", df['UserID'].nunique())
-                m3.metric("Sessions", df['SessionID'].nunique())
+                m2.metric("Unique Users", df['UserID'].cat.categories.size)
+                m3.metric("Sessions", df['SessionID'].cat.categories.size)
                 
-                responded = df[df['Response'] != ""].shape[0]
+                responded = int(df['Response'].ne("").sum())
                 resp_rate = round((responded / len(df)) * 100, 1)
                 m4.metric("Response Rate", f"{resp_rate}%")
-                
-                st.markdown("<br>", unsafe_allow_html=True) 
 
                 # 2. CHARTS AREA
                 c1, c2 = st.columns(2)
                 
-                with c1:
-                    st.markdown("<div style='background:white; padding:15px; border-radius:10px; box-shadow:0 2px 4px rgba(0,0,0,0.1)'>", unsafe_allow_html=True)
+                # Card look and spacing come from the CSS block (.st-key-*)
+                with c1, st.container(border=True, key="activity_card"):
                     st.markdown("#### 📊 Activity Volume")
-                    df['Date'] = df['Timestamp'].dt.date
-                    daily_counts = df.groupby('Date').size().reset_index(name='Count')
-                    
-                    fig_activity = px.bar(
-                        daily_counts, x='Date', y='Count',
-                        color_discrete_sequence=['#005A9C'] 
-                    )
-                    fig_activity.update_layout(
-                        paper_bgcolor="rgba(0,0,0,0)", 
-                        plot_bgcolor="rgba(0,0,0,0)",
-                        xaxis_title="", yaxis_title="Queries",
-                        margin=dict(l=20, r=20, t=30, b=20)
-                    )
-                    st.plotly_chart(fig_activity, use_container_width=True)
-                    st.markdown("</div>", unsafe_allow_html=True)
-
-                with c2:
-                    st.markdown("<div style='background:white; padding:15px; border-radius:10px; box-shadow:0 2px 4px rgba(0,0,0,0.1)'>", unsafe_allow_html=True)
+                    # Unsorted value_counts, then sort only the few distinct days (cheaper than groupby().size())
+                    daily_counts = df['Date'].value_counts(sort=False).sort_index().rename_axis('Date').reset_index(name='Count')
+                    fig_activity = activity_figure(daily_counts)
+                    # theme=None: keep our layout as is, no Streamlit theme merge
+                    st.plotly_chart(fig_activity, use_container_width=True, theme=None, key="activity_chart")
+
+                with c2, st.container(border=True, key="top_card"):
                     st.markdown("#### 🔥 Top 5 Topics")
-                    top_questions = df['Query'].value_counts().head(5).reset_index()
-                    top_questions.columns = ['Question', 'Count']
-                    
-                    fig_top = px.bar(
-                        top_questions, x='Count', y='Question', 
-                        orientation='h', text='Count',
-                        color_discrete_sequence=['#EC008C'] 
-                    )
-                    fig_top.update_layout(
-                        yaxis=dict(autorange="reversed"),
-                        paper_bgcolor="rgba(0,0,0,0)", 
-                        plot_bgcolor="rgba(0,0,0,0)",
-                        xaxis_title="Frequency", yaxis_title="",
-                        margin=dict(l=20, r=20, t=30, b=20)
-                    )
-                    st.plotly_chart(fig_top, use_container_width=True)
-                    st.markdown("</div>", unsafe_allow_html=True)
-
-                st.markdown("<br>", unsafe_allow_html=True)
+                    top_questions = df['Query'].value_counts().head(5).rename_axis('Question').reset_index(name='Count')
+                    fig_top = top_figure(top_questions)
+                    st.plotly_chart(fig_top, use_container_width=True, theme=None, key="top_chart")
 
                 # 3. DATA TABLE
                 st.markdown("### 🗂 Detailed Conversation Logs")
                 
+                # Newest first, so the head is the most recent activity
+                preview = df.head(MAX_DISPLAY_ROWS)
                 st.dataframe(
-                    df[['Timestamp', 'UserID', 'Query', 'Response']],
+                    preview[['Timestamp', 'UserID', 'Query', 'Response']],
                     use_container_width=True,
+                    hide_index=True, # leftover message positions, nothing to show
                     column_config={
                         "Timestamp": st.column_config.DatetimeColumn("Time", format="D MMM, HH:mm"),
                         "Query": st.column_config.TextColumn("User Asked", width="medium"),
                         "Response": st.column_config.TextColumn("Bot Replied", width="large"),
                     },
-                    height=400
+                    height=400,
+                    key="logs_df"
                 )
+                if len(df) > MAX_DISPLAY_ROWS:
+                    st.caption(f"Showing first {MAX_DISPLAY_ROWS:,} of {len(df):,} rows. Download the CSV for all of them.")
                 
                 # 4. DOWNLOAD
-                csv = df.to_csv(index=False).encode('utf-8-sig')
+                csv = make_csv(bot_id, start_date, end_date, len(df), df)
                 st.download_button(
                     label="📥 Download Clean CSV",
                     data=csv,
                     file_name=f"Focus_Report_{start_date}_{end_date}.csv",
                     mime="text/csv"
                 )
+                parquet = make_parquet(bot_id, start_date, end_date, len(df), df)
+                st.download_button(
+                    label="📥 Download Parquet",
+                    data=parquet,
+                    file_name=f"Focus_Report_{start_date}_{end_date}.parquet",
+                    mime="application/octet-stream"
+                )
             else:
                 st.warning("⚠️ Data fetched, but all messages were filtered out (Welcome messages hidden).")
         else:
@@ -449,6 +709,11 @@ def main():
         </div>
         """, unsafe_allow_html=True)
 
+    # --- DEBUG ---
+    if st.secrets.get("DEBUG", False):
+        st.sidebar.markdown("### 🐞 Fetch Cache")
+        st.sidebar.json(cache_stats())
+
 if __name__ == "__main__":
     main()
     